@@ -1,5 +1,7 @@
 #!/usr/bin/env python3
+import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 ROOT = Path("/mnt/data2/dexmimic/workspace/egoengine-webite/videos/blending")
@@ -9,29 +11,49 @@ BRIGHTNESS = -0.05   # <0 darker, >0 brighter
 CONTRAST   = 1.10    # 1.0 no change, >1 more punch
 CRF        = 18
 PRESET     = "veryfast"
+ENCODER    = os.environ.get("FFMPEG_ENCODER", "libx264")   # e.g. h264_nvenc
+
+# ===== Parallelism =====
+THREADS_PER_FFMPEG = 2   # libx264 threads per job
+JOBS = max(1, (os.cpu_count() or 1) // THREADS_PER_FFMPEG)
 
 TASKS = {
     "drawer":  [1, 2, 3, 4],
     "mustard": [1, 2, 3, 4],
 }
 
+def encoder_args():
+    if ENCODER.endswith("_nvenc"):
+        return ["-c:v", ENCODER, "-preset", "p4", "-tune", "hq",
+                "-rc", "vbr", "-cq", str(CRF), "-b:v", "0"]
+    return ["-c:v", ENCODER, "-preset", PRESET, "-crf", str(CRF)]
+
 def tune_inplace(in_path: Path):
     tmp_path = in_path.with_suffix(".tmp.mp4")
+    # NVENC: decode on the GPU too; frames come back to system memory for eq
+    hwaccel = ["-hwaccel", "cuda"] if ENCODER.endswith("_nvenc") else []
     cmd = [
-        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error", "-stats",
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        *hwaccel,
         "-i", str(in_path),
         "-map_metadata", "0",
         "-movflags", "+faststart",
         "-vf", f"eq=brightness={BRIGHTNESS}:contrast={CONTRAST}",
-        "-c:v", "libx264", "-preset", PRESET, "-crf", str(CRF),
-        "-c:a", "copy",
+        *encoder_args(),
+        "-threads", str(THREADS_PER_FFMPEG),
+        "-an",   # inputs are silent; skip the audio path entirely
         str(tmp_path),
     ]
-    subprocess.run(cmd, check=True)
+    try:
+        subprocess.run(cmd, check=True)
+    except Exception:
+        tmp_path.unlink(missing_ok=True)   # original stays untouched
+        raise
     tmp_path.replace(in_path)
 
 def main():
-    processed, missing = 0, 0
+    processed, missing, failed = 0, 0, 0
+    jobs = []
     for task, ids in TASKS.items():
         for i in ids:
             in_file = ROOT / task / str(i) / "removed_w_mask_5.mp4"
@@ -39,10 +61,22 @@ def main():
                 print(f"[skip] not found: {in_file}")
                 missing += 1
                 continue
+            jobs.append(in_file)
+
+    # Each file is an independent libx264 encode, so run them side by side.
+    with ThreadPoolExecutor(max_workers=JOBS) as ex:
+        futures = {ex.submit(tune_inplace, f): f for f in jobs}
+        for fut in as_completed(futures):
+            in_file = futures[fut]
+            try:
+                fut.result()
+            except Exception as e:
+                print(f"[fail] {in_file}: {e}")
+                failed += 1
+                continue
             print(f"[overwrite] {in_file} (brightness={BRIGHTNESS}, contrast={CONTRAST})")
-            tune_inplace(in_file)
             processed += 1
-    print(f"\nDone. processed={processed}, missing={missing}")
+    print(f"\nDone. processed={processed}, missing={missing}, failed={failed}")
 
 if __name__ == "__main__":
     main()
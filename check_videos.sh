@@ -11,12 +11,30 @@ fi
 
 ok=0; bad=0
 
+# One ffprobe per file: sets fmt, vcodec, pixfmt (first video stream), acodec (first audio stream)
+probe() {
+  local line kv k v ctype codec pf
+  local -a kvs
+  fmt=""; vcodec=""; pixfmt=""; acodec=""
+  while IFS= read -r line; do
+    ctype=""; codec=""; pf=""
+    IFS='|' read -ra kvs <<< "$line"
+    for kv in "${kvs[@]}"; do
+      k="${kv%%=*}"; v="${kv#*=}"
+      case "$k" in
+        format_name) fmt="$v" ;;
+        codec_type)  ctype="$v" ;;
+        codec_name)  codec="$v" ;;
+        pix_fmt)     pf="$v" ;;
+      esac
+    done
+    if [[ "$ctype" == "video" && -z "$vcodec" ]]; then vcodec="$codec"; pixfmt="$pf"; fi
+    if [[ "$ctype" == "audio" && -z "$acodec" ]]; then acodec="$codec"; fi
+  done < <(ffprobe -v error -show_entries format=format_name:stream=codec_type,codec_name,pix_fmt -of compact=p=0 "$1" || true)
+}
+
 is_ok() {
-  local f="$1" fmt vcodec pixfmt acodec
-  fmt="$(ffprobe -v error -show_entries format=format_name -of default=nk=1:nw=1 "$f" || true)"
-  vcodec="$(ffprobe -v error -select_streams v:0 -show_entries stream=codec_name -of default=nk=1:nw=1 "$f" || true)"
-  pixfmt="$(ffprobe -v error -select_streams v:0 -show_entries stream=pix_fmt   -of default=nk=1:nw=1 "$f" || true)"
-  acodec="$(ffprobe -v error -select_streams a:0 -show_entries stream=codec_name -of default=nk=1:nw=1 "$f" || true)"
+  probe "$1"
 
   # container must be mp4/mov; video h264; pixel yuv420p; audio aac or none
   echo "$fmt" | grep -Eqi 'mp4|mov' || return 1
@@ -33,10 +51,8 @@ while IFS= read -r -d '' f; do
     echo "OK  : $f"
     ok=$((ok+1))
   else
-    # quick peek at codecs for debugging
-    vcodec="$(ffprobe -v error -select_streams v:0 -show_entries stream=codec_name,pix_fmt -of default=nk=1:nw=1 "$f" || true)"
-    acodec="$(ffprobe -v error -select_streams a:0 -show_entries stream=codec_name -of default=nk=1:nw=1 "$f" || echo none)"
-    echo "FIX : $f   [v=$vcodec, a=${acodec:-none}]"
+    # codecs from the probe in is_ok, for debugging
+    echo "FIX : $f   [v=$vcodec $pixfmt, a=${acodec:-none}]"
     bad=$((bad+1))
   fi
 done < <(find "$ROOT" -type f \( -iname '*.mp4' -o -iname '*.mov' -o -iname '*.mkv' -o -iname '*.webm' -o -iname '*.avi' \) -print0)
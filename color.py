@@ -4,8 +4,8 @@
 """
 批量处理所有 cropped_video.mp4：
 1) 逐帧读取，按你的代码做通道均衡（不改时长、不拼接）
-2) 先用 OpenCV 写临时 mp4v 文件
-3) 若系统有 ffmpeg，则转成 H.264 + yuv420p + faststart（网页更稳）并原地覆盖
+2) 处理后的 BGR 帧直接经 stdin 管道送给 ffmpeg，一次编码成
+   H.264 + yuv420p + faststart（网页更稳），再原地覆盖
 
 用法：
   python fix_cropped_videos.py \
@@ -15,58 +15,159 @@
 import os
 import sys
 import cv2
+import fcntl
 import glob
+import numpy as np
+import queue
 import shutil
+import threading
 import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
-def color_fix(im):
+try:
+    import cupy as cp   # 可选：--gpu 时在 GPU 上算 color_fix
+except ImportError:
+    cp = None
+
+P = 6.0
+EPS = 1e-6
+PREFETCH = 2   # 每个文件的解码 / 编码队列深度；并行度交给 --jobs
+PIPE_BUFSIZE = 1 << 20   # 写 ffmpeg stdin 的缓冲（用户态 + Linux 内核管道）
+ENCODER = os.environ.get("FFMPEG_ENCODER", "libx264")   # 有 NVIDIA GPU 时可设 h264_nvenc
+# uint8 输入只有 256 种取值：x**p 预先查表，均值用直方图做内积
+POW_LUT = np.arange(256, dtype=np.float64) ** P
+
+def pow_means(im):
+    """每个通道的 mean(x**p)（直方图 × 查表）。"""
+    n = im.shape[0] * im.shape[1]
+    m = np.empty(im.shape[2], dtype=np.float64)
+    for c in range(im.shape[2]):
+        hist = cv2.calcHist([im], [c], None, [256], [0, 256]).ravel()
+        m[c] = (hist @ POW_LUT) / n
+    return m
+
+def color_fix(im, m=None, planes=None, out=None):
     # === 按你给的公式逐帧处理（不加其它“聪明”操作）===
-    imf = im.astype('float32')
-    p = 6.0
-    eps = 1e-6
-    m = ( (imf ** p).mean(axis=(0, 1)) + eps ) ** (1.0 / p)   # per-channel “gray”
-    scale = (m.mean() / (m + eps))                            # 拉到相近灰度
-    im_corr = (imf * scale).clip(0, 255)
-    # 你原文这里没有真正 gamma，只是保持数值范围；我忠实保留
-    im_out = im_corr.clip(0, 255).astype('uint8')
-    return im_out
+    # m: 可选的整段 per-channel “gray”（见 probe_channel_means）；None 则逐帧计算
+    # planes / out: 可复用的 3 个 HxW 平面和 HxWx3 输出（process_one 保证帧尺寸与之一致）
+    if m is None:
+        m = (pow_means(im) + EPS) ** (1.0 / P)  # per-channel “gray”
+    scale = m.mean() / (m + EPS)                # 拉到相近灰度
+    # 拆成连续平面（SoA），每个通道一次连续的 SIMD 缩放，原地写回
+    # convertScaleAbs 自带饱和截断到 [0, 255]（scale>0，不会出现负值）
+    chans = cv2.split(im, planes)
+    for ch, s in zip(chans, scale):
+        cv2.convertScaleAbs(ch, dst=ch, alpha=float(s))
+    return cv2.merge(chans, out)
+
+def color_fix_gpu(im, m=None):
+    # 与 color_fix 相同的公式，用 CuPy 在 GPU 上算（需要 cupy）
+    x = cp.asarray(im).astype(cp.float32)
+    if m is None:
+        m = cp.asnumpy((cp.power(x, P).mean(axis=(0, 1), dtype=cp.float64) + EPS) ** (1.0 / P))
+    scale = m.mean() / (m + EPS)
+    x *= cp.asarray(scale, dtype=cp.float32)
+    out = cp.clip(cp.rint(x), 0, 255).astype(cp.uint8)   # 与 convertScaleAbs 一样四舍五入
+    return cp.asnumpy(out)
+
+def probe_channel_means(fpath: Path, stride: int = 15):
+    """每 stride 帧抽一帧，估计整段视频的 per-channel “gray”。
+       跳过的帧只 grab() 不 retrieve()，省掉解码后的像素转换。"""
+    cap = cv2.VideoCapture(str(fpath))
+    if not cap.isOpened():
+        return None
+    acc, n, idx = 0.0, 0, 0
+    while cap.grab():
+        if idx % stride == 0:
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            if frame.ndim == 2:  # 灰度保险
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            acc = acc + pow_means(frame)
+            n += 1
+        idx += 1
+    cap.release()
+    if n == 0:
+        return None
+    return (acc / n + EPS) ** (1.0 / P)
 
 def has_ffmpeg():
     return shutil.which("ffmpeg") is not None
 
-def transcode_h264(src_mp4: Path):
-    """用 ffmpeg 转成 H.264 / yuv420p / faststart；尽量不动分辨率。
-       若宽或高为奇数，自动用 scale 调成偶数（yuv420p 需要）。"""
-    # 先探测分辨率
-    try:
-        import json
-        prob = sp.run([
-            "ffprobe","-v","error","-select_streams","v:0",
-            "-show_entries","stream=width,height","-of","json",str(src_mp4)
-        ], check=True, capture_output=True, text=True)
-        info = json.loads(prob.stdout)
-        w = info["streams"][0]["width"]
-        h = info["streams"][0]["height"]
-    except Exception:
-        w = h = None
-
-    tmp = src_mp4.with_suffix(".h264.tmp.mp4")
-    vf = []
-    if w and h and (w % 2 or h % 2):
-        vf = ["-vf", f"scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+def encoder_args(crf: int = 20, preset: str = "veryfast") -> list:
+    """H.264 编码参数；NVENC 用 -cq 对应 libx264 的 -crf。"""
+    if ENCODER.endswith("_nvenc"):
+        return ["-c:v",ENCODER,"-preset","p4","-tune","hq",
+                "-rc","vbr","-cq",str(crf),"-b:v","0"]
+    return ["-c:v",ENCODER,"-preset",preset,"-crf",str(crf)]
 
-    cmd = [
-        "ffmpeg","-y","-v","error","-i", str(src_mp4),
+def ffmpeg_writer_cmd(out_path: Path, w: int, h: int, fps: float, threads: int = 0) -> list:
+    """stdin 读原始 BGR 帧 → H.264 / yuv420p / faststart；尽量不动分辨率。
+       若宽或高为奇数，自动用 scale 调成偶数（yuv420p 需要）。
+       threads: libx264 线程数（0 = ffmpeg 自动）。"""
+    vf = []
+    if w % 2 or h % 2:
+        vf = ["-vf", "scale=trunc(iw/2)*2:trunc(ih/2)*2"]
+    return [
+        "ffmpeg","-y","-v","error",
+        "-f","rawvideo","-pix_fmt","bgr24",
+        "-s",f"{w}x{h}","-r",f"{fps:.6f}",
+        "-i","pipe:0",
         *vf,
-        "-c:v","libx264","-pix_fmt","yuv420p","-movflags","+faststart",
-        "-preset","veryfast","-crf","20","-an",
-        str(tmp)
+        *encoder_args(),
+        "-pix_fmt","yuv420p","-movflags","+faststart",
+        "-threads",str(threads),"-an",
+        str(out_path)
     ]
-    sp.run(cmd, check=True)
-    tmp.replace(src_mp4)
 
-def process_one(fpath: Path):
+def open_ffmpeg(cmd: list):
+    """启动 ffmpeg，stdin 用大缓冲；Linux 上同时把内核管道从默认 64 KiB 调大，
+       每帧（几 MB）写入时少几次阻塞唤醒。"""
+    proc = sp.Popen(cmd, stdin=sp.PIPE, bufsize=PIPE_BUFSIZE)
+    if hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(proc.stdin.fileno(), fcntl.F_SETPIPE_SZ, PIPE_BUFSIZE)
+        except OSError:
+            pass   # 超过 /proc/sys/fs/pipe-max-size 时保持默认
+    return proc
+
+def read_frames(cap, q, stop, errors, size):
+    """解码线程：grab + retrieve 逐帧放进队列，结束时放 None。
+       解码异常记进 errors，主线程据此放弃这个文件（不能当成正常 EOF）。
+       size=(h, w) 是传给 ffmpeg -s 的尺寸；帧尺寸不符会让 rawvideo 错位，也算错误。"""
+    try:
+        while not stop.is_set():
+            if not cap.grab():
+                break
+            ok, frame = cap.retrieve()
+            if not ok:
+                break
+            if frame.shape[:2] != size:
+                raise RuntimeError(f"frame size {frame.shape[1]}x{frame.shape[0]} "
+                                   f"!= reported {size[1]}x{size[0]}")
+            q.put(frame)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        q.put(None)
+
+def write_frames(stream, q, errors):
+    """编码线程：把队列里的帧写进 ffmpeg stdin，遇到 None 结束。
+       写失败后继续取空队列，避免主线程卡在 put 上。"""
+    while True:
+        buf = q.get()
+        if buf is None:
+            break
+        if errors:
+            continue
+        try:
+            stream.write(buf)
+        except Exception as e:
+            errors.append(e)
+
+def process_one(fpath: Path, probe_stride: int = 0, threads: int = 0, gpu: bool = False):
     cap = cv2.VideoCapture(str(fpath))
     if not cap.isOpened():
         print(f"[SKIP] cannot open: {fpath}")
@@ -80,58 +181,76 @@ def process_one(fpath: Path):
         print(f"[SKIP] bad size: {fpath}")
         return False
 
-    # 先写到 mp4v 临时文件（保持原 fps/尺寸）
-    tmp_mp4v = fpath.with_suffix(".tmp.mp4")
-    fourcc = cv2.VideoWriter_fourcc(*"mp4v")
-    writer = cv2.VideoWriter(str(tmp_mp4v), fourcc, fps, (w, h))
+    # probe_stride > 0：整段用同一组增益（抽帧估计），避免逐帧闪烁
+    m = probe_channel_means(fpath, probe_stride) if probe_stride > 0 else None
+
+    # 直接编码到临时文件（保持原 fps/尺寸），只编码一次
+    tmp = fpath.with_suffix(".tmp.mp4")
+    proc = open_ffmpeg(ffmpeg_writer_cmd(tmp, w, h, fps, threads))
     frames = 0
+    # 复用的平面和输出帧；输出环足够大，排队等待写入的帧不会被覆盖
+    planes = [np.empty((h, w), dtype=np.uint8) for _ in range(3)]
+    outs = [np.empty((h, w, 3), dtype=np.uint8) for _ in range(PREFETCH + 2)]
 
-    while True:
-        ok, frame = cap.read()
-        if not ok:
-            break
-        if frame.ndim == 2:  # 灰度保险
-            frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
-        out = color_fix(frame)
-        writer.write(out)
-        frames += 1
+    # 三段流水线：解码线程 → 主线程 color_fix → 编码线程
+    # OpenCV 解码和管道写入都会释放 GIL，三段可以在不同核上重叠
+    read_q, write_q = queue.Queue(maxsize=PREFETCH), queue.Queue(maxsize=PREFETCH)
+    stop, errors = threading.Event(), []
+    reader = threading.Thread(target=read_frames, args=(cap, read_q, stop, errors, (h, w)), daemon=True)
+    writer = threading.Thread(target=write_frames, args=(proc.stdin, write_q, errors), daemon=True)
+    reader.start()
+    writer.start()
 
-    writer.release()
-    cap.release()
+    try:
+        while not errors:
+            frame = read_q.get()
+            if frame is None:
+                break
+            if frame.ndim == 2:  # 灰度保险
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            if gpu:
+                out = color_fix_gpu(frame, m)
+            else:
+                out = color_fix(frame, m, planes, outs[frames % len(outs)])
+            write_q.put(memoryview(out).cast("B"))
+            frames += 1
+    finally:
+        stop.set()
+        while reader.is_alive():  # 腾出队列空间，让解码线程退出
+            try:
+                read_q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_q.put(None)
+        writer.join()
+        cap.release()
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        ret = proc.wait()
 
-    if frames == 0:
-        tmp_mp4v.unlink(missing_ok=True)
-        print(f"[WARN] 0 frames: {fpath}")
+    # 解码或写管道出错：输出不完整，删掉临时文件，原文件不动
+    if errors:
+        tmp.unlink(missing_ok=True)
+        print(f"[ERR] {fpath}: {errors[0]}")
+        return False
+    if ret != 0 or frames == 0:
+        tmp.unlink(missing_ok=True)
+        if ret != 0:
+            print(f"[ERR] ffmpeg exited with {ret}: {fpath}")
+        else:
+            print(f"[WARN] 0 frames: {fpath}")
         return False
 
-    # 用临时覆盖原文件（先备份）
-    bak = fpath.with_suffix(".bak.mp4")
+    # 用临时覆盖原文件（replace 是原子操作，失败时原文件不动）
     try:
-        fpath.replace(bak)
-        tmp_mp4v.replace(fpath)
+        tmp.replace(fpath)
     except Exception as e:
         print(f"[ERR] replace failed: {fpath} -> {e}")
-        # 尝试回滚
-        if fpath.exists(): fpath.unlink(missing_ok=True)
-        if bak.exists(): bak.replace(fpath)
+        tmp.unlink(missing_ok=True)
         return False
-    finally:
-        if tmp_mp4v.exists():
-            tmp_mp4v.unlink(missing_ok=True)
 
-    # 若有 ffmpeg，则再转成 H.264（网页最稳）
-    if has_ffmpeg():
-        try:
-            transcode_h264(fpath)
-        except sp.CalledProcessError as e:
-            print(f"[WARN] ffmpeg transcode failed for {fpath}: {e}")
-            # 失败也不回滚，先保持 mp4v，可浏览器上测试
-    else:
-        print("[INFO] ffmpeg 不在 PATH，已保留 mp4v 编码（多数浏览器可播，但不如 H.264 稳）。")
-
-    # 成功后删备份
-    if bak.exists():
-        bak.unlink(missing_ok=True)
     print(f"[OK]  {fpath}  ({frames} frames @ {fps:.3f} fps)")
     return True
 
@@ -140,8 +259,21 @@ def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--root", type=str, required=True,
                     help="包含若干子文件夹的根目录，每个子文件夹里有 cropped_video.mp4")
+    ap.add_argument("--probe-stride", type=int, default=0,
+                    help="每 N 帧抽一帧估计整段增益（0 = 逐帧计算，原行为）")
+    ap.add_argument("--jobs", type=int, default=max(1, (os.cpu_count() or 1) // 2),
+                    help="同时处理的文件数（默认 CPU 核数的一半）")
+    ap.add_argument("--gpu", action="store_true",
+                    help="用 CuPy 在 GPU 上做 color_fix（建议配合 FFMPEG_ENCODER=h264_nvenc）")
     args = ap.parse_args()
 
+    if not has_ffmpeg():
+        print("[ERR] ffmpeg 不在 PATH，无法编码 H.264。")
+        sys.exit(1)
+    if args.gpu and cp is None:
+        print("[ERR] --gpu 需要 cupy（pip install cupy-cuda12x）。")
+        sys.exit(1)
+
     root = Path(args.root).resolve()
     files = sorted(root.glob("*/cropped_video.mp4"))
     if not files:
@@ -149,19 +281,27 @@ def main():
         sys.exit(0)
 
     print(f"[RUN] total {len(files)} files\n")
+    # 各文件互相独立：并行处理，每个 ffmpeg 分到 cpu/jobs 个线程
+    jobs = max(1, args.jobs)
+    threads = max(1, (os.cpu_count() or 1) // jobs)
     ok = fail = 0
-    for f in files:
-        try:
-            if process_one(f):
-                ok += 1
-            else:
+    ex = ThreadPoolExecutor(max_workers=jobs)
+    try:
+        futures = {ex.submit(process_one, f, args.probe_stride, threads, args.gpu): f for f in files}
+        for fut in as_completed(futures):
+            try:
+                if fut.result():
+                    ok += 1
+                else:
+                    fail += 1
+            except Exception as e:
+                print(f"[ERR] {futures[fut]}: {e}")
                 fail += 1
-        except KeyboardInterrupt:
-            print("\n[INTERRUPTED]")
-            break
-        except Exception as e:
-            print(f"[ERR] {f}: {e}")
-            fail += 1
+    except KeyboardInterrupt:
+        print("\n[INTERRUPTED]")
+        ex.shutdown(wait=False, cancel_futures=True)
+    finally:
+        ex.shutdown()
 
     print(f"\n[SUMMARY] ok={ok}, fail={fail}")
 
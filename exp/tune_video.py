@@ -3,13 +3,23 @@
 
 import os
 import argparse
+import fcntl
+import queue
 import subprocess
-from typing import Tuple, List
+import threading
+from functools import lru_cache
+from typing import Tuple, List, Optional
 
 import cv2
 import numpy as np
 from tqdm import tqdm
 
+BATCH = 16               # max frames per apply_adjust call
+BATCH_BYTES = 16 << 20   # cap per batch arena; large frames get smaller batches
+PREFETCH = 1             # batches queued between stages
+ENCODER = os.environ.get("FFMPEG_ENCODER", "libx264")  # e.g. h264_nvenc
+PIPE_BUFSIZE = 1 << 20  # ffmpeg stdin buffer (Python side and Linux pipe)
+
 
 def ensure_dir(p: str):
     os.makedirs(p, exist_ok=True)
@@ -19,6 +29,7 @@ def open_video(path: str):
     cap = cv2.VideoCapture(path)
     if not cap.isOpened():
         raise RuntimeError(f"Failed to open video: {path}")
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # only affects live sources
     fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
     w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
@@ -26,6 +37,17 @@ def open_video(path: str):
     return cap, fps, w, h, n_frames
 
 
+def encoder_args(crf: int = 18, preset: str = "veryfast") -> list:
+    """H.264 encoder flags for ENCODER; NVENC's -cq stands in for -crf."""
+    if ENCODER.endswith("_nvenc"):
+        return [
+            "-c:v", ENCODER,
+            "-preset", "p4", "-tune", "hq",
+            "-rc", "vbr", "-cq", str(crf), "-b:v", "0",
+        ]
+    return ["-c:v", ENCODER, "-preset", preset, "-crf", str(crf)]
+
+
 def ffmpeg_writer_cmd(out_path: str, w: int, h: int, fps: float) -> list:
     """Write raw BGR frames via stdin → H.264 (yuv420p) file."""
     return [
@@ -35,30 +57,29 @@ def ffmpeg_writer_cmd(out_path: str, w: int, h: int, fps: float) -> list:
         "-s", f"{w}x{h}",
         "-r", f"{fps:.6f}",
         "-i", "pipe:0",
-        "-vcodec", "libx264",
-        "-preset", "veryfast",
-        "-crf", "18",
+        *encoder_args(),
         "-pix_fmt", "yuv420p",
         "-movflags", "+faststart",
         out_path,
     ]
 
 
-def apply_adjust(
-    frame_bgr: np.ndarray,
-    exposure: float = 1.0,                # aka brightness multiplier
-    contrast: float = 1.0,                # 1.0 keeps contrast
-    rgb_ratio: Tuple[float, float, float] = (1.0, 1.0, 1.0),  # (R,G,B)
-    gamma: float = 1.0                    # 1.0 = off
+@lru_cache(maxsize=8)
+def adjust_lut(
+    exposure: float,
+    contrast: float,
+    rgb_ratio: Tuple[float, float, float],
+    gamma: float,
 ) -> np.ndarray:
     """
-    Processing order:
-      1) exposure (global brightness multiplier)
-      2) per-channel gains (R,G,B)  [NOTE: input is BGR]
-      3) contrast around mid-gray (128)
-      4) gamma correction (sRGB-like; 1.0 = off)
+    (256,1,3) uint8 table for cv2.LUT on BGR frames.
+
+    Every step of apply_adjust is pointwise per channel, so the table is
+    built by running the original float32 steps on the 256 possible input
+    values; cv2.LUT then reproduces the float path bit for bit.
     """
-    img = frame_bgr.astype(np.float32)
+    img = np.broadcast_to(np.arange(256, dtype=np.uint8).reshape(256, 1, 1), (256, 1, 3))
+    img = img.astype(np.float32)
 
     # 1) global brightness (exposure) multiplier
     img *= float(exposure)
@@ -78,8 +99,106 @@ def apply_adjust(
         img = np.clip(img, 0, 255) / 255.0
         img = np.power(img, 1.0 / float(gamma)) * 255.0
 
-    img = np.clip(img, 0, 255).astype(np.uint8)
-    return img
+    return np.ascontiguousarray(np.clip(img, 0, 255).astype(np.uint8))
+
+
+def read_frames(cap, q: queue.Queue, stop: threading.Event, limit: int,
+                arenas: List[np.ndarray], errors: List[Exception]):
+    """Decoder thread: fill (B,H,W,3) arenas in turn and push (arena, count)
+    onto q, decoding until EOF (or `limit` frames if > 0); push None at the end.
+
+    Exceptions are recorded in `errors` so main can tell them from EOF.
+    """
+    k = 0
+    done = 0
+    try:
+        while not stop.is_set() and (limit <= 0 or done < limit):
+            arena = arenas[k % len(arenas)]
+            n = 0
+            while n < len(arena) and (limit <= 0 or done + n < limit):
+                if not cap.grab():
+                    break
+                ok, f = cap.retrieve(arena[n])
+                if not ok:
+                    break
+                if not np.shares_memory(f, arena):
+                    if f.shape != arena[n].shape:
+                        raise RuntimeError(
+                            f"Decoded frame {f.shape} does not match "
+                            f"the reported size {arena[n].shape}"
+                        )
+                    arena[n] = f
+                n += 1
+            if n == 0:
+                break
+            q.put((arena, n))
+            done += n
+            k += 1
+            if n < len(arena):
+                break
+    except Exception as e:
+        errors.append(e)
+    finally:
+        q.put(None)
+
+
+def write_frames(stream, q: queue.Queue, errors: List[Exception]):
+    """Encoder thread: write byte buffers from q to stream until None.
+
+    After a failed write it keeps draining q so producers never block.
+    """
+    while True:
+        buf = q.get()
+        if buf is None:
+            break
+        if errors:
+            continue
+        try:
+            stream.write(buf)
+        except Exception as e:
+            errors.append(e)
+
+
+def open_ffmpeg(cmd: list) -> subprocess.Popen:
+    """Start ffmpeg with a large stdin buffer.
+
+    On Linux the kernel pipe is also grown from its 64 KiB default, so
+    multi-MB frame writes need fewer blocking round trips.
+    """
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, bufsize=PIPE_BUFSIZE)
+    if hasattr(fcntl, "F_SETPIPE_SZ"):
+        try:
+            fcntl.fcntl(proc.stdin.fileno(), fcntl.F_SETPIPE_SZ, PIPE_BUFSIZE)
+        except OSError:
+            pass  # above /proc/sys/fs/pipe-max-size: keep the default
+    return proc
+
+
+def apply_adjust(
+    frame_bgr: np.ndarray,
+    exposure: float = 1.0,                # aka brightness multiplier
+    contrast: float = 1.0,                # 1.0 keeps contrast
+    rgb_ratio: Tuple[float, float, float] = (1.0, 1.0, 1.0),  # (R,G,B)
+    gamma: float = 1.0,                   # 1.0 = off
+    out: Optional[np.ndarray] = None,     # uint8 result, same shape as frame
+) -> np.ndarray:
+    """
+    Processing order:
+      1) exposure (global brightness multiplier)
+      2) per-channel gains (R,G,B)  [NOTE: input is BGR]
+      3) contrast around mid-gray (128)
+      4) gamma correction (sRGB-like; 1.0 = off)
+
+    All four steps are pointwise on uint8, so they run as a single cv2.LUT
+    pass. `frame_bgr` may be one (H,W,3) frame or a (B,H,W,3) batch, which
+    OpenCV sees as one tall image. Pass a preallocated `out` buffer to avoid
+    per-frame allocations.
+    """
+    lut = adjust_lut(float(exposure), float(contrast),
+                     tuple(float(v) for v in rgb_ratio), float(gamma))
+    src = frame_bgr.reshape(-1, *frame_bgr.shape[-2:])
+    dst = out.reshape(src.shape) if out is not None else None
+    return cv2.LUT(src, lut, dst=dst).reshape(frame_bgr.shape)
 
 
 def main():
@@ -104,29 +223,74 @@ def main():
     ensure_dir(os.path.dirname(os.path.abspath(args.out)) or ".")
 
     cap, fps, w, h, n_total = open_video(args.inp)
-    n_frames = min(n_total, args.limit) if args.limit and args.limit > 0 else n_total
+    # CAP_PROP_FRAME_COUNT is only a container estimate (often off for VFR
+    # sources): it sizes the progress bar, while decoding runs to EOF.
+    limit = args.limit if args.limit and args.limit > 0 else 0
+    n_est = n_total if n_total > 0 else None
+    if limit:
+        n_est = min(n_est, limit) if n_est else limit
 
     cmd = ffmpeg_writer_cmd(args.out, w, h, fps)
-    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE)
+    proc = open_ffmpeg(cmd)
 
-    with tqdm(total=n_frames, desc="Processing", leave=False) as pbar:
-        for i in range(n_frames):
-            ok, f = cap.read()
-            if not ok:
-                break
-            adj = apply_adjust(
-                f,
-                exposure=args.exposure,
-                contrast=args.contrast,
-                rgb_ratio=(args.r, args.g, args.b),
-                gamma=args.gamma,
-            )
-            proc.stdin.write(adj.tobytes())
-            pbar.update(1)
-
-    cap.release()
-    proc.stdin.close()
-    proc.wait()
+    # Decode, adjust and encode overlap on separate threads; OpenCV and the
+    # pipe write both release the GIL. Frames move in batches through rings
+    # of arenas. Per stage at most PREFETCH batches are queued, one is being
+    # consumed and one is being filled, so PREFETCH + 2 arenas is all the
+    # pipeline can have in flight. The batch shrinks with frame size to keep
+    # each arena under BATCH_BYTES (1080p: 2 frames, 4K: 1 frame).
+    batch = max(1, min(BATCH, BATCH_BYTES // (h * w * 3)))
+    ring = PREFETCH + 2
+    in_arenas = [np.empty((batch, h, w, 3), dtype=np.uint8) for _ in range(ring)]
+    out_arenas = [np.empty((batch, h, w, 3), dtype=np.uint8) for _ in range(ring)]
+    read_q, write_q = queue.Queue(maxsize=PREFETCH), queue.Queue(maxsize=PREFETCH)
+    stop, errors = threading.Event(), []
+    reader = threading.Thread(target=read_frames,
+                              args=(cap, read_q, stop, limit, in_arenas, errors), daemon=True)
+    writer = threading.Thread(target=write_frames, args=(proc.stdin, write_q, errors), daemon=True)
+    reader.start()
+    writer.start()
+
+    try:
+        with tqdm(total=n_est, desc="Processing", leave=False) as pbar:
+            i = 0
+            while not errors:
+                item = read_q.get()
+                if item is None:
+                    break
+                arena, n = item
+                adj = apply_adjust(
+                    arena[:n],
+                    exposure=args.exposure,
+                    contrast=args.contrast,
+                    rgb_ratio=(args.r, args.g, args.b),
+                    gamma=args.gamma,
+                    out=out_arenas[i % ring][:n],
+                )
+                # Hand ffmpeg the arena's own buffer instead of a tobytes() copy.
+                write_q.put(memoryview(adj).cast("B"))
+                i += 1
+                pbar.update(n)
+    finally:
+        stop.set()
+        while reader.is_alive():  # make room so the decoder can exit
+            try:
+                read_q.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        write_q.put(None)
+        writer.join()
+        cap.release()
+        try:
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        ret = proc.wait()
+
+    if errors:
+        raise RuntimeError(f"Processing failed, output incomplete: {errors[0]}")
+    if ret != 0:
+        raise RuntimeError(f"ffmpeg exited with {ret}: {args.out}")
     print(f"[Done] Wrote: {args.out}")
 
 
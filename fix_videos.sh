@@ -36,12 +36,32 @@ clean_path() {
   printf '%s' "$p"
 }
 
+# 每个文件只跑一次 ffprobe：设置 fmt、vcodec/pixfmt/vw/vh（第一路视频）、acodec（第一路音频）
+probe() {
+  local line kv k v ctype codec pf w h
+  local -a kvs
+  fmt=""; vcodec=""; pixfmt=""; vw=0; vh=0; acodec=""
+  while IFS= read -r line; do
+    ctype=""; codec=""; pf=""; w=0; h=0
+    IFS='|' read -ra kvs <<< "$line"
+    for kv in "${kvs[@]}"; do
+      k="${kv%%=*}"; v="${kv#*=}"
+      case "$k" in
+        format_name) fmt="$v" ;;
+        codec_type)  ctype="$v" ;;
+        codec_name)  codec="$v" ;;
+        pix_fmt)     pf="$v" ;;
+        width)       w="$v" ;;
+        height)      h="$v" ;;
+      esac
+    done
+    if [[ "$ctype" == "video" && -z "$vcodec" ]]; then vcodec="$codec"; pixfmt="$pf"; vw="$w"; vh="$h"; fi
+    if [[ "$ctype" == "audio" && -z "$acodec" ]]; then acodec="$codec"; fi
+  done < <(ffprobe -v error -show_entries format=format_name:stream=codec_type,codec_name,pix_fmt,width,height -of compact=p=0 "$1" || true)
+}
+
 is_ok() {
-  local f="$1" fmt vcodec pixfmt acodec
-  fmt="$(ffprobe -v error -show_entries format=format_name -of default=nk=1:nw=1 "$f" || true)"
-  vcodec="$(ffprobe -v error -select_streams v:0 -show_entries stream=codec_name -of default=nk=1:nw=1 "$f" || true)"
-  pixfmt="$(ffprobe -v error -select_streams v:0 -show_entries stream=pix_fmt   -of default=nk=1:nw=1 "$f" || true)"
-  acodec="$(ffprobe -v error -select_streams a:0 -show_entries stream=codec_name -of default=nk=1:nw=1 "$f" || true)"
+  probe "$1"
   echo "$fmt" | grep -Eqi '(^|,)mp4(,|$)' || return 1
   [[ "$vcodec" == "h264" ]] || return 1
   [[ "$pixfmt" == "yuv420p" ]] || return 1
@@ -49,8 +69,12 @@ is_ok() {
   return 0
 }
 
-has_audio() {
-  ffprobe -v error -select_streams a:0 -show_entries stream=index -of csv=p=0 "$1" >/dev/null 2>&1
+# 视频流已是 H.264 + yuv420p 且宽高为偶数：无需重编码，直接 -c:v copy
+video_ok() {
+  probe "$1"
+  [[ "$vcodec" == "h264" && "$pixfmt" == "yuv420p" ]] || return 1
+  [[ "$vw" =~ ^[0-9]+$ && "$vh" =~ ^[0-9]+$ ]] || return 1
+  (( vw > 0 && vh > 0 && vw % 2 == 0 && vh % 2 == 0 ))
 }
 
 convert_one() {
@@ -65,8 +89,24 @@ convert_one() {
   dir="$(dirname "$in")"; base="$(basename "$in")"
   tmp="$dir/.tmp.$base"
 
-  echo "  → Converting: $in  (encoder=$ENC)"
-  if has_audio "$in"; then
+  if video_ok "$in"; then
+    # 只是容器 / 音频不合规：视频流直接拷贝，只转音频（或原样拷贝 aac）
+    # acodec 来自 video_ok 里的 probe
+    local aopts=(-an)
+    if [[ -n "$acodec" ]]; then
+      if [[ "$acodec" == "aac" ]]; then
+        aopts=(-c:a copy)
+      else
+        aopts=(-c:a aac -b:a "$AUDIOBITRATE" -ac 2 -ar 48000)
+      fi
+    fi
+    echo "  → Remuxing: $in  (video stream copied)"
+    ffmpeg -hide_banner -loglevel error -y -i "$in" \
+      -c:v copy "${aopts[@]}" \
+      -movflags +faststart "$tmp"
+  elif [[ -n "$acodec" ]]; then
+    # 同样复用 video_ok 里 probe 出的 acodec，不再跑第二次 ffprobe
+    echo "  → Converting: $in  (encoder=$ENC)"
     if [[ "$ENC" == "libx264" ]]; then
       ffmpeg -hide_banner -loglevel error -y -i "$in" \
         -vf "format=yuv420p,scale=trunc(iw/2)*2:trunc(ih/2)*2" \
@@ -81,6 +121,7 @@ convert_one() {
         -movflags +faststart "$tmp"
     fi
   else
+    echo "  → Converting: $in  (encoder=$ENC)"
     if [[ "$ENC" == "libx264" ]]; then
       ffmpeg -hide_banner -loglevel error -y -i "$in" \
         -vf "format=yuv420p,scale=trunc(iw/2)*2:trunc(ih/2)*2" \